@@ -0,0 +1,264 @@
+# Multi-session load test for the Streamlit app (new.py)
+#
+# Drives many simulated sessions through Streamlit's AppTest, with OpenAI, GitHub and SMTP
+# replaced by local stand-ins, and reports per-rerun latency percentiles, outbound requests
+# per rerun and process memory per session. Each session loads the page, selects societies,
+# sends the email report, uses both chatbots and runs a small bulk import.
+#
+# Limitation: AppTest swaps a process-wide Runtime instance on every run, so within one process
+# reruns are executed strictly one at a time. Sessions only overlap between reruns (and with the
+# app's background threads), and "incl. lock wait" is just the time spent waiting for that lock.
+# It is NOT a model of a busy multi-threaded server. For reruns that really run in parallel use
+# --processes, where every process is a separate app instance with its own caches and loader
+# (like running several server replicas).
+#
+# Usage: python loadtest.py --sessions 50 --processes 4 --remote-latency 0.2
+import argparse
+import base64
+import multiprocessing
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import openai
+import requests
+import smtplib
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "new.py")
+WORKBOOK = "Pharma_Society_Report.xlsx"
+
+# Thread names of the app's background work, their calls are reported separately
+THREAD_GROUPS = {"report-loader": "loader", "society-import": "import"}
+
+# AppTest is not thread-safe, only one rerun may execute at a time in a process
+APPTEST_LOCK = threading.Lock()
+
+
+# Counts outbound calls made through the stand-ins, grouped by the kind of thread making them
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"rerun": {}, "loader": {}, "import": {}}
+
+    def record(self, service):
+        group = THREAD_GROUPS.get(threading.current_thread().name, "rerun")
+        with self._lock:
+            self.counts[group][service] = self.counts[group].get(service, 0) + 1
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = str(payload)
+
+    def json(self):
+        return self._payload
+
+
+# OpenAI 0.28 responses are read both as dicts and through `.choices`
+class FakeCompletion(dict):
+    @property
+    def choices(self):
+        return self["choices"]
+
+
+# Local replacements for GitHub, OpenAI and SMTP
+def make_stand_ins(counter, latency):
+    with open(os.path.join(APP_DIR, WORKBOOK), "rb") as f:
+        workbook = base64.b64encode(f.read()).decode("utf-8")
+
+    def fake_get(url, *args, **kwargs):
+        counter.record("github_get")
+        time.sleep(latency)
+        return FakeResponse(200, {"content": workbook, "sha": "loadtest"})
+
+    def fake_put(url, *args, **kwargs):
+        counter.record("github_put")
+        time.sleep(latency)
+        return FakeResponse(200, {"content": {"sha": "loadtest"}})
+
+    def fake_completion(*args, **kwargs):
+        counter.record("openai")
+        time.sleep(latency)
+        return FakeCompletion(choices=[{"message": {"content": "Stand-in answer."}}])
+
+    def fake_smtp(*args, **kwargs):
+        counter.record("smtp")
+        return mock.MagicMock()
+
+    return [
+        mock.patch.object(requests, "get", fake_get),
+        mock.patch.object(requests, "put", fake_put),
+        mock.patch.object(openai.ChatCompletion, "create", fake_completion),
+        mock.patch.object(smtplib, "SMTP", fake_smtp),
+        mock.patch.object(smtplib, "SMTP_SSL", fake_smtp),
+    ]
+
+
+# Resident set size of this process in bytes
+def process_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def find_button(at, label_prefix):
+    return next(button for button in at.button if button.label.startswith(label_prefix))
+
+
+# One simulated user: load the page, pick societies, email them, use both chatbots, bulk import
+def run_session(session_index, args):
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    latencies = {"rerun": [], "waited": []}
+
+    def timed(action):
+        queued = time.perf_counter()
+        with APPTEST_LOCK:
+            start = time.perf_counter()
+            action()
+            end = time.perf_counter()
+        latencies["rerun"].append(end - start)
+        latencies["waited"].append(end - queued)
+
+    timed(at.run)
+    options = [o for o in at.selectbox(key="dropdown").options if o]
+    for society in options[:3]:
+        timed(lambda: at.selectbox(key="dropdown").set_value(society).run())
+    timed(lambda: find_button(at, "Send selected Society data").click().run())
+    timed(lambda: at.chat_input[0].set_value(f"Question {session_index} about the report").run())
+    timed(lambda: at.chat_input[1].set_value(f"Question {session_index} about societies").run())
+
+    if args.import_societies:
+        names = "\n".join(f"Load Test Society {session_index}-{i}" for i in range(args.import_societies))
+        timed(lambda: at.file_uploader[0].set_value((f"societies-{session_index}.csv", names.encode(), "text/csv")).run())
+        timed(lambda: find_button(at, "Generate answers for").click().run())
+        # Poll like the progress fragment would, until the job's summary is shown
+        deadline = time.time() + args.timeout
+        while "import_summary" not in at.session_state and time.time() < deadline:
+            time.sleep(0.2)
+            timed(at.run)
+        if "import_summary" not in at.session_state:
+            raise RuntimeError(f"Session {session_index}: import did not finish within {args.timeout}s")
+
+    timed(at.run)
+    if at.exception:
+        raise RuntimeError(f"Session {session_index} failed: {at.exception[0].value}")
+    return at, latencies
+
+
+# Run a share of the sessions in this process and return plain, picklable results
+def run_worker(session_indices, args):
+    counter = CallCounter()
+    patches = make_stand_ins(counter, args.remote_latency)
+    for patch in patches:
+        patch.start()
+
+    # Run from a scratch directory so chat history files don't land in the repo
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    shutil.copy(os.path.join(APP_DIR, WORKBOOK), workdir)
+    os.chdir(workdir)
+
+    try:
+        # Warm up once so shared caches and the background loader exist before measuring
+        warmup_args = argparse.Namespace(**{**vars(args), "import_societies": 0})
+        run_session(-1 - session_indices[0], warmup_args)
+        counter.counts["rerun"].clear()
+        baseline_rss = process_rss()
+        baseline_threads = threading.active_count()
+
+        with ThreadPoolExecutor(max_workers=args.concurrency or len(session_indices)) as pool:
+            results = list(pool.map(lambda i: run_session(i, args), session_indices))
+
+        # Keep the sessions alive while measuring memory
+        sessions = [at for at, _ in results]
+        rss_added = process_rss() - baseline_rss
+        threads_added = threading.active_count() - baseline_threads
+    finally:
+        for patch in patches:
+            patch.stop()
+        os.chdir(APP_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "sessions": len(sessions),
+        "rerun": [latency for _, session in results for latency in session["rerun"]],
+        "waited": [latency for _, session in results for latency in session["waited"]],
+        "counts": counter.counts,
+        "rss_added": rss_added,
+        "threads_added": threads_added,
+    }
+
+
+def merge_counts(workers, group):
+    merged = {}
+    for worker in workers:
+        for service, count in worker["counts"][group].items():
+            merged[service] = merged.get(service, 0) + count
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the Streamlit app with simulated sessions. Reruns are serialized within "
+                    "a process (AppTest limitation), use --processes for reruns that run in parallel."
+    )
+    parser.add_argument("--sessions", type=int, default=50, help="number of simulated sessions")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="separate app instances to spread sessions over, the only way to get parallel reruns")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="sessions in flight per process (default: all); their reruns still run one at a time")
+    parser.add_argument("--import-societies", type=int, default=2, help="societies bulk-imported by each session")
+    parser.add_argument("--remote-latency", type=float, default=0.0, help="seconds added to every stand-in call")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-rerun timeout in seconds")
+    args = parser.parse_args()
+
+    shares = [list(range(args.sessions))[i::args.processes] for i in range(args.processes)]
+    shares = [share for share in shares if share]
+    started = time.perf_counter()
+    if len(shares) == 1:
+        workers = [run_worker(shares[0], args)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(len(shares)) as pool:
+            workers = pool.starmap(run_worker, [(share, args) for share in shares])
+    elapsed = time.perf_counter() - started
+
+    sessions = sum(worker["sessions"] for worker in workers)
+    reruns = sum(len(worker["rerun"]) for worker in workers)
+    print(f"Sessions: {sessions} over {len(workers)} process(es), reruns: {reruns}, wall time: {elapsed:.2f}s")
+    print("Reruns run one at a time within each process, only separate processes rerun in parallel.")
+    for kind, label in (("rerun", "Rerun latency"), ("waited", "Rerun latency incl. lock wait")):
+        latencies = [latency for worker in workers for latency in worker[kind]]
+        print(f"{label} (ms): " + ", ".join(
+            f"p{pct}={percentile(latencies, pct) * 1000:.1f}" for pct in (50, 90, 95, 99)
+        ) + f", max={max(latencies) * 1000:.1f}, mean={statistics.mean(latencies) * 1000:.1f}")
+    print("Outbound requests per rerun: " + (", ".join(
+        f"{service}={count / reruns:.2f}" for service, count in sorted(merge_counts(workers, "rerun").items())
+    ) or "none"))
+    for group, label in (("import", "Bulk import job requests"), ("loader", "Background loader requests")):
+        print(f"{label}: " + (", ".join(
+            f"{service}={count}" for service, count in sorted(merge_counts(workers, group).items())
+        ) or "none"))
+    rss_per_session = sum(worker["rss_added"] for worker in workers) / sessions
+    print(f"Process memory per session: {rss_per_session / 1024:.1f} KiB")
+    print(f"Threads added during the run: {sum(worker['threads_added'] for worker in workers)}")
+
+
+if __name__ == "__main__":
+    main()
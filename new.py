@@ -7,10 +7,14 @@ from dotenv import load_dotenv
 import base64
 import requests
 import json
+import html
+import re
+import uuid
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import threading
+import time
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 import plotly.express as px
@@ -58,7 +62,7 @@ st.markdown("""
 st.markdown('<div class="main-header">💊 Pharma Society QnA Report Generator</div>', unsafe_allow_html=True)
 st.write("🔬 This Q&A generator allows users to fetch answers to predefined queries about pharmaceutical societies by entering the society name in the text box. It uses OpenAI to generate answers specific to the entered society and displays them in a tabular format. Users can download this report as an Excel file or as a CSV file. It updates the data automatically every Monday at 10 AM IST.")
 
-# Define all available society options
+# Societies refreshed by the weekly job
 all_societies = [
     "FLASCO (Florida Society of Clinical Oncology)", 
     "GASCO (Georgia Society of Clinical Oncology)",
@@ -69,18 +73,6 @@ all_societies = [
     "ESHOS (Empire State Hematology Oncology Society)"
 ]
 
-# Define all available society options
-new_societies = [
-    "",
-    "FLASCO (Florida Society of Clinical Oncology)", 
-    "GASCO (Georgia Society of Clinical Oncology)",
-    "PSOH (Pennsylvania Society of Oncology and Hematology)",
-    "WVOS (West Virginia Oncology Society)",
-    "DSCO (Delaware Society of Clinical Oncology)",
-    "OSNJ (Oncology Society of New Jersey)",
-    "ESHOS (Empire State Hematology Oncology Society)"
-]
-
 # Define questions
 questions = [
     "What is the membership count for society_name? Respond with one word (number) only. That should just be an integer nothing like approx or members just a number.",
@@ -102,34 +94,45 @@ FILE_PATH = "Pharma_Society_Report.xlsx"  # Path to the Excel file in the repo
 # GitHub API URL
 BASE_URL = f"https://api.github.com/repos/{GITHUB_REPO}/contents/{FILE_PATH}"
 
-# Helper function to fetch Excel file from GitHub
-def fetch_excel_from_github():
-    headers = {"Authorization": f"Bearer {GITHUB_TOKEN}"}
-    response = requests.get(BASE_URL, headers=headers)
-    if response.status_code == 200:
-        content = response.json()
-        file_data = base64.b64decode(content["content"])
-        df = pd.read_excel(BytesIO(file_data))
-        sha = content["sha"]  # Required for updating the file
-        return df, sha
-    else:
-        st.error("Failed to fetch the Excel file from GitHub.")
-        return None, None
+# How often the shared report is revalidated against GitHub in the background
+REFRESH_INTERVAL_SECONDS = 300
 
-# Load data from GitHub
-existing_data, sha = fetch_excel_from_github()
-if existing_data is None:
-    existing_data = pd.DataFrame()
+# GitHub can briefly serve the previous file after a commit, so revalidations
+# started within this long of a publish are discarded
+PUBLISH_GRACE_SECONDS = 60
 
-# Initialize session state to track dropdown options
-if "available_societies" not in st.session_state:
-    st.session_state.available_societies = new_societies.copy()
+# Number of generated societies committed to GitHub at once by a bulk import
+IMPORT_BATCH_SIZE = 10
 
-if "report_data" not in st.session_state:
-    st.session_state.report_data = pd.DataFrame(columns=existing_data.columns if not existing_data.empty else ["Society Name"])
+# Finished import jobs whose result was never shown are dropped after this long
+IMPORT_JOB_TTL_SECONDS = 60 * 60
+
+# Download the Excel file from GitHub without touching the UI (safe to call from background threads)
+def request_excel_from_github():
+    headers = {"Authorization": f"Bearer {GITHUB_TOKEN}"}
+    try:
+        response = requests.get(BASE_URL, headers=headers, timeout=30)
+    except requests.RequestException:
+        return None, None
+    if response.status_code == 200:
+        try:
+            content = response.json()
+            file_data = base64.b64decode(content["content"])
+            df = pd.read_excel(BytesIO(file_data))
+            sha = content["sha"]  # Required for updating the file
+        except Exception as e:
+            # e.g. an empty "content" for files over 1 MB, or a corrupted workbook
+            print(f"Failed to parse the Excel file from GitHub: {e}")
+            return None, None
+        return df, sha
+    return None, None
 
-# Dropdown menu to select a society
-selected_society = st.selectbox("Select a Society", st.session_state.available_societies, key="dropdown")
+# Helper function to fetch Excel file from GitHub
+def fetch_excel_from_github():
+    df, sha = request_excel_from_github()
+    if df is None:
+        st.error("Failed to fetch the Excel file from GitHub.")
+    return df, sha
 
 # Column aliases
 def alias_columns(df):
@@ -148,31 +151,141 @@ def alias_columns(df):
     }
     return df.rename(columns=column_aliases)
 
+# Build the shared report frame for one data version (the file sha).
+# It is aliased and indexed by society once, and must be treated as read-only.
+def build_report_frame(df):
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["Society Name"])
+    # Blank names can't be selected and would break sorting the selector options
+    df = df.dropna(subset=["Society Name"]).astype({"Society Name": str})
+    frame = alias_columns(df.drop_duplicates(subset="Society Name"))
+    frame.index = pd.Index(frame["Society Name"].values)
+    return frame
+
+# Process-wide report loader (stale-while-revalidate).
+# Page loads always read the last good snapshot, a daemon thread refetches it from GitHub
+# every REFRESH_INTERVAL_SECONDS, and the refresh job pushes new data right after committing it.
+class ReportLoader:
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._frame = build_report_frame(None)
+        self._version = None
+        self._loaded_at = None
+        self._published_at = 0.0
+        self.last_error = None
+        # Serve the copy bundled with the app until GitHub answers
+        if os.path.exists(FILE_PATH):
+            try:
+                self._set(pd.read_excel(FILE_PATH), "local")
+            except Exception as e:
+                self.last_error = f"Failed to read bundled {FILE_PATH}: {e}"
+        threading.Thread(target=self._run, name="report-loader", daemon=True).start()
+
+    # Store a new snapshot. A revalidation passes the time its fetch started, and its
+    # result is dropped if data was published since, so it can't replace newer data.
+    def _set(self, df, version, fetch_started=None, published=False):
+        with self._lock:
+            current_version = self._version
+        frame = build_report_frame(df) if version != current_version else None
+        with self._lock:
+            if fetch_started is not None and fetch_started < self._published_at + PUBLISH_GRACE_SECONDS:
+                return False
+            if frame is not None:
+                self._frame, self._version = frame, version
+            self._loaded_at = time.time()
+            if published:
+                self._published_at = self._loaded_at
+        return True
+
+    # Current (frame, version, loaded_at) without any remote I/O
+    def snapshot(self):
+        with self._lock:
+            return self._frame, self._version, self._loaded_at
+
+    # Refetch from GitHub, keeping the previous snapshot if that fails
+    def revalidate(self):
+        fetch_started = time.time()
+        df, sha = request_excel_from_github()
+        if df is None:
+            self.last_error = "Failed to fetch the Excel file from GitHub."
+            return False
+        if self._set(df, sha, fetch_started):
+            self.last_error = None
+        return True
+
+    # Called by the refresh job once it has committed new data
+    def publish(self, df, version):
+        self._set(df, version, published=True)
+        self.last_error = None
+
+    def _run(self):
+        while True:
+            # Keep revalidating even if one attempt fails unexpectedly
+            try:
+                self.revalidate()
+            except Exception as e:
+                self.last_error = f"Failed to refresh the report data: {e}"
+            time.sleep(self.interval)
+
+# One loader per process, shared by every session
+@st.cache_resource
+def get_report_loader():
+    return ReportLoader(REFRESH_INTERVAL_SECONDS)
+
+# Excel export of the shared report, serialized once per data version
+@st.cache_resource(max_entries=2)
+def report_excel_bytes(version, _frame):
+    return convert_df_to_excel(_frame)
+
+# Load data from the shared snapshot (never waits on GitHub)
+report_loader = get_report_loader()
+report_frame, sha, loaded_at = report_loader.snapshot()
+st.session_state.data_version = sha
+
+# Show the data version and age, and rerun the page as soon as a newer version is loaded
+@st.fragment(run_every=5)
+def data_status():
+    _, version, updated_at = report_loader.snapshot()
+    if version != st.session_state.get("data_version"):
+        st.rerun()
+    if updated_at is None:
+        st.caption("⏳ Loading report data...")
+        return
+    age_minutes = int((time.time() - updated_at) // 60)
+    st.caption(f"🗂️ Data version `{str(version)[:7]}`, checked {age_minutes} min ago")
+    if report_loader.last_error:
+        st.caption(f"⚠️ {report_loader.last_error} Showing the last loaded data.")
+
+data_status()
+
+# Each session only keeps the society names it has selected, the rows live in the shared frame
+if "selected_societies" not in st.session_state:
+    st.session_state.selected_societies = []
+
+# Rows of the shared report for the societies selected in this session
+def selected_report_view():
+    keys = [name for name in st.session_state.selected_societies if name in report_frame.index]
+    return report_frame.loc[keys]
+
+# Dropdown menu to select a society, built from the societies in the report (type to search)
+selected_society = st.selectbox("Select a Society", ["", *sorted(report_frame.index)], key="dropdown")
+
 # Function to fetch and display data for the selected society
 def display_selected_society(selected):
     if selected:  # Ensure a valid society is selected
         # Check if the selected society is already in the GitHub file
-        if existing_data is not None and not existing_data.empty:
-            # Filter data for the selected society
-            society_data = existing_data[existing_data["Society Name"] == selected]
-            
-            if not society_data.empty:
-                # Check if the society data is already in the report
-                if "report_data" not in st.session_state:
-                    st.session_state.report_data = pd.DataFrame()  # Initialize report_data if not already done
-                
-                # Filter out duplicates before appending
-                is_duplicate = st.session_state.report_data["Society Name"].isin(society_data["Society Name"]).any()
-                if not is_duplicate:
-                    st.session_state.report_data = pd.concat([st.session_state.report_data, society_data], ignore_index=True)
+        if not report_frame.empty:
+            if selected in report_frame.index:
+                # Only the society name is stored per session
+                if selected not in st.session_state.selected_societies:
+                    st.session_state.selected_societies.append(selected)
                     st.success(f"Data for {selected} appended to the report.")
-                    # st.session_state.available_societies.remove(selected) # Remove the selected society from the dropdown options
                 else:
                     st.info(f"Data for {selected} is already in the report.")
-                
-                # Apply column aliasing and display the report
-                aliased_data = alias_columns(st.session_state.report_data)  # Apply column aliasing
-                st.dataframe(aliased_data)
+
+                # Display the selected rows from the shared (already aliased) report
+                st.dataframe(selected_report_view(), hide_index=True)
             else:
                 st.warning(f"No existing data found for {selected}.")
         else:
@@ -181,8 +294,9 @@ def display_selected_society(selected):
 # Trigger the display of the selected society
 display_selected_society(selected_society)
 
-# Helper function to update Excel file in GitHub
-def update_excel_in_github(df, sha):
+# Commit a DataFrame as the Excel file in GitHub without touching the UI.
+# Returns (True, new sha) or (False, error text), and pushes committed data to the shared loader.
+def commit_excel_to_github(df, sha, message="Updated Excel file via Streamlit"):
     headers = {"Authorization": f"Bearer {GITHUB_TOKEN}"}
     # Convert DataFrame to binary Excel content
     output = BytesIO()
@@ -191,15 +305,65 @@ def update_excel_in_github(df, sha):
     file_content = output.getvalue()
     # Prepare API payload
     payload = {
-        "message": "Updated Excel file via Streamlit",
+        "message": message,
         "content": base64.b64encode(file_content).decode("utf-8"),
         "sha": sha
     }
-    response = requests.put(BASE_URL, headers=headers, data=json.dumps(payload))
+    try:
+        response = requests.put(BASE_URL, headers=headers, data=json.dumps(payload), timeout=60)
+    except requests.RequestException as e:
+        return False, str(e)
     if response.status_code == 200:
+        new_sha = response.json()["content"]["sha"]
+        # Push the committed data to the shared loader so sessions pick it up right away
+        get_report_loader().publish(df, new_sha)
+        return True, new_sha
+    return False, response.text
+
+# Helper function to update Excel file in GitHub
+def update_excel_in_github(df, sha):
+    ok, result = commit_excel_to_github(df, sha)
+    if ok:
         st.success("Data updated successfully!")
     else:
-        st.error(f"Failed to update the data: {response.text}")
+        st.error(f"Failed to update the data: {result}")
+
+# Serializes read-modify-write commits of the Excel file across all sessions and jobs
+@st.cache_resource
+def get_github_commit_lock():
+    return threading.Lock()
+
+# Append rows for societies not yet in the GitHub file, on top of its latest version.
+# Returns (True, number of rows appended) or (False, error text).
+def append_rows_to_github(rows, message):
+    with get_github_commit_lock():
+        df, sha = request_excel_from_github()
+        if df is None:
+            return False, "Failed to fetch the Excel file from GitHub."
+        rows = rows[~rows["Society Name"].isin(df["Society Name"])]
+        if rows.empty:
+            return True, 0
+        ok, result = commit_excel_to_github(pd.concat([df, rows], ignore_index=True), sha, message)
+        return (True, len(rows)) if ok else (False, result)
+
+# Ask OpenAI every question for one society and return the report row
+def generate_society_row(society, on_error=None):
+    society_data = {"Society Name": society}
+    modified_questions = [q.replace("society_name", society) for q in questions]
+
+    for i, question in enumerate(modified_questions):
+        try:
+            response = openai.ChatCompletion.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "user", "content": question}]
+            )
+            answer = response["choices"][0]["message"]["content"].strip()
+            society_data[questions[i]] = answer
+        except Exception as e:
+            if on_error is not None:
+                on_error(f"Error with '{question}': {e}")
+            society_data[questions[i]] = "Error"
+    return society_data
 
 # Function to fetch data for all societies
 def fetch_all_societies_data():
@@ -209,21 +373,7 @@ def fetch_all_societies_data():
     ])
 
     for society in all_societies:
-        society_data = {"Society Name": society}
-        modified_questions = [q.replace("society_name", society) for q in questions]
-
-        for i, question in enumerate(modified_questions):
-            try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": question}]
-                )
-                answer = response["choices"][0]["message"]["content"].strip()
-                society_data[questions[i]] = answer
-            except Exception as e:
-                st.error(f"Error with '{question}': {e}")
-                society_data[questions[i]] = "Error"
-
+        society_data = generate_society_row(society, on_error=st.error)
         report_data = pd.concat([report_data, pd.DataFrame([society_data])], ignore_index=True)
     
 
@@ -237,40 +387,43 @@ def fetch_all_societies_data():
 
 def update_report_data(report_data, sha):
     if report_data is not None and sha is not None:
-        # Fetch the existing data from GitHub
-        df, _ = fetch_excel_from_github()
-        if df is not None:
-            # Iterate through the new report data
-            for _, row in report_data.iterrows():
-                society_name = row["Society Name"]
-                new_membership_count = row.get(
-                    "What is the membership count for society_name? Respond with one word (number) only. That should just be an integer nothing like approx or members just a number.",
-                    None
-                )
-
-                # Ensure the new membership count is a valid integer
-                try:
-                    new_membership_count = int(new_membership_count)
-                except (ValueError, TypeError):
-                    st.warning(f"Invalid membership count for {society_name}, skipping update.")
-                    continue  # Skip this entry if the membership count is invalid
-
-                # Check if the society exists in the existing data
-                if society_name in df["Society Name"].values:
-                    # Update the existing row directly
-                    index = df[df["Society Name"] == society_name].index[0]
-                    df.loc[index, 
-                        "What is the membership count for society_name? Respond with one word (number) only. That should just be an integer nothing like approx or members just a number."
-                    ] = new_membership_count
-                else:
-                    # Append the new row if the society doesn't exist
-                    new_row = row.to_dict()
-                    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-
-            # Upload the updated DataFrame back to GitHub
-            update_excel_in_github(df, sha)
-        else:
-            st.error("Failed to fetch the existing data from GitHub.")
+        # Re-fetch and commit under the shared lock, so import batches committed
+        # during the (long) generation pass are neither overwritten nor cause a conflict
+        with get_github_commit_lock():
+            # Fetch the latest data and SHA from GitHub
+            df, sha = fetch_excel_from_github()
+            if df is not None:
+                # Iterate through the new report data
+                for _, row in report_data.iterrows():
+                    society_name = row["Society Name"]
+                    new_membership_count = row.get(
+                        "What is the membership count for society_name? Respond with one word (number) only. That should just be an integer nothing like approx or members just a number.",
+                        None
+                    )
+
+                    # Ensure the new membership count is a valid integer
+                    try:
+                        new_membership_count = int(new_membership_count)
+                    except (ValueError, TypeError):
+                        st.warning(f"Invalid membership count for {society_name}, skipping update.")
+                        continue  # Skip this entry if the membership count is invalid
+
+                    # Check if the society exists in the existing data
+                    if society_name in df["Society Name"].values:
+                        # Update the existing row directly
+                        index = df[df["Society Name"] == society_name].index[0]
+                        df.loc[index, 
+                            "What is the membership count for society_name? Respond with one word (number) only. That should just be an integer nothing like approx or members just a number."
+                        ] = new_membership_count
+                    else:
+                        # Append the new row if the society doesn't exist
+                        new_row = row.to_dict()
+                        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
+
+                # Upload the updated DataFrame back to GitHub
+                update_excel_in_github(df, sha)
+            else:
+                st.error("Failed to fetch the existing data from GitHub.")
     else:
         st.error("No report data or SHA provided for update.")
 
@@ -282,6 +435,145 @@ def convert_df_to_excel(df):
     processed_data = output.getvalue()
     return processed_data
 
+# Background job generating answers for uploaded societies.
+# Rows become visible as soon as each society finishes and are committed every IMPORT_BATCH_SIZE societies.
+# Societies with a failed answer are never committed, so they stay eligible for a later import.
+class ImportJob:
+    def __init__(self, societies):
+        self.societies = societies
+        self.rows = []
+        self.failed = []
+        self.committed = 0
+        self.errors = []
+        self.done = False
+        self.finished_at = None
+        threading.Thread(target=self._run, name="society-import", daemon=True).start()
+
+    def _run(self):
+        pending = []
+        try:
+            for society in self.societies:
+                row_errors = []
+                row = generate_society_row(society, on_error=row_errors.append)
+                if row_errors:
+                    self.failed.append(society)
+                    self.errors.append(f"Skipped {society}, {len(row_errors)} answers failed: {row_errors[0]}")
+                    continue
+                self.rows.append(row)
+                pending.append(row)
+                if len(pending) >= IMPORT_BATCH_SIZE:
+                    self._commit(pending)
+                    pending = []
+            if pending:
+                self._commit(pending)
+        except Exception as e:
+            self.errors.append(f"Import stopped: {e}")
+        finally:
+            # Always finish, so the progress poller stops
+            self.finished_at = time.time()
+            self.done = True
+
+    def _commit(self, rows):
+        try:
+            ok, result = append_rows_to_github(
+                pd.DataFrame(rows), f"Imported {len(rows)} societies via Streamlit"
+            )
+        except Exception as e:
+            ok, result = False, e
+        if ok:
+            # Rows already added by someone else in the meantime are not counted
+            self.committed += result
+        else:
+            self.errors.append(f"Failed to commit {len(rows)} societies: {result}")
+
+# Import jobs of the process by id, so they outlive the session that started them
+@st.cache_resource
+def get_import_jobs():
+    return {}
+
+# Drop finished jobs that no session picked up within IMPORT_JOB_TTL_SECONDS
+def evict_import_jobs():
+    jobs = get_import_jobs()
+    cutoff = time.time() - IMPORT_JOB_TTL_SECONDS
+    for job_id, job in list(jobs.items()):
+        if job.done and job.finished_at < cutoff:
+            jobs.pop(job_id, None)
+
+# Read society names from the first column of an uploaded CSV or Excel file
+def read_society_names(uploaded_file):
+    try:
+        if uploaded_file.name.lower().endswith(".csv"):
+            df = pd.read_csv(uploaded_file, header=None)
+        else:
+            df = pd.read_excel(uploaded_file, header=None)
+    except Exception as e:
+        st.error(f"Could not read {uploaded_file.name}: {e}")
+        return None
+    if df.empty:
+        return []
+    names = df.iloc[:, 0].dropna().astype(str).str.strip()
+    names = [name for name in names if name and name.lower() != "society name"]
+    return list(dict.fromkeys(names))
+
+# Show an import job's progress and the rows generated so far
+def show_import_job(job):
+    total = len(job.societies)
+    processed = len(job.rows) + len(job.failed)
+    st.progress(
+        processed / total,
+        text=f"{processed}/{total} societies processed, {job.committed} committed, {len(job.failed)} failed"
+    )
+    if job.rows:
+        st.dataframe(alias_columns(pd.DataFrame(job.rows)), hide_index=True)
+    for error in job.errors[-5:]:
+        st.warning(error)
+
+# Poll a running import job, and rerun the page once it is finished
+@st.fragment(run_every=2)
+def import_job_progress(job):
+    if job.done:
+        st.rerun()
+    show_import_job(job)
+
+# Bulk import section
+with st.expander("📥 Bulk import societies"):
+    evict_import_jobs()
+    import_job = get_import_jobs().get(st.session_state.get("import_job_id"))
+
+    uploaded_file = st.file_uploader("Upload a CSV or Excel list of society names", type=["csv", "xlsx"])
+    names = read_society_names(uploaded_file) if uploaded_file is not None else None
+    if names is not None:
+        new_names = [name for name in names if name not in report_frame.index]
+        st.write(f"{len(names)} societies found, {len(new_names)} not in the report yet.")
+        # Only one import per session at a time, so the same societies aren't generated twice
+        if import_job is not None and not import_job.done:
+            st.info("An import is already running, wait for it to finish before starting another one.")
+        elif new_names and st.button(f"Generate answers for {len(new_names)} new societies"):
+            job_id = uuid.uuid4().hex
+            import_job = ImportJob(new_names)
+            get_import_jobs()[job_id] = import_job
+            st.session_state.import_job_id = job_id
+            st.session_state.pop("import_summary", None)
+
+    if import_job is not None:
+        if import_job.done:
+            show_import_job(import_job)
+            # The final result has been shown, only keep a small summary in the session
+            get_import_jobs().pop(st.session_state.pop("import_job_id"), None)
+            st.session_state.import_summary = {
+                "committed": import_job.committed,
+                "total": len(import_job.societies),
+                "failed": import_job.failed,
+            }
+        else:
+            import_job_progress(import_job)
+
+    summary = st.session_state.get("import_summary")
+    if summary is not None:
+        st.success(f"Import finished: {summary['committed']} of {summary['total']} societies committed.")
+        if summary["failed"]:
+            st.warning(f"{len(summary['failed'])} societies failed and can be imported again: {', '.join(summary['failed'])}")
+
 # # Button to fetch the existing Excel file
 # if st.button("View Data"):
 #     df, sha = fetch_excel_from_github()
@@ -300,11 +592,9 @@ def convert_df_to_excel(df):
 #             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 #         )
 
-df, sha = fetch_excel_from_github()
-if df is not None:
-    aliased_df = alias_columns(df)
+if not report_frame.empty:
     # Add download button for the Excel file
-    excel_data = convert_df_to_excel(aliased_df)
+    excel_data = report_excel_bytes(sha, report_frame)
     st.download_button(
         label="Download data as Excel",
         data=excel_data,
@@ -409,7 +699,7 @@ sender_password = "afpt eoyt asaq qzjh"
 # Send email if button clicked
 if st.button("Send selected Society data to Google Sheets"):
     if receiver_email and email_subject and sender_email and sender_password:
-        df = st.session_state.report_data
+        df = selected_report_view()
         html_table = dataframe_to_html(df)
         email_body = f"""
         <html>
@@ -498,6 +788,93 @@ if st.button("Send selected Society data to Google Sheets"):
 
 com.iframe("https://lottie.host/embed/cab54264-ba4f-4663-8415-9992125e6d0a/dQgwO9lDGf.lottie")
 
+# Chat history is kept per session in append-only JSONL files and only the latest page is rendered
+CHAT_HISTORY_DIR = "chat_history"
+CHAT_PAGE_SIZE = 20
+CHAT_CONTEXT_MESSAGES = 20  # Most recent turns sent to OpenAI
+CHAT_SESSION_COOKIE = "qna_chat_session"
+CHAT_RETENTION_DAYS = 30
+
+# Session id is kept in a browser cookie, never in the URL, so shared page links don't expose the history.
+# The cookie is renewed on every new session, so it expires CHAT_RETENTION_DAYS after the last visit,
+# the same basis prune_chat_history uses for the history files.
+def get_chat_session_id():
+    session_id = st.context.cookies.get(CHAT_SESSION_COOKIE, "")
+    # Ignore missing or malformed ids, the id is also used in file names
+    if not isinstance(session_id, str) or not re.fullmatch(r"[0-9a-f]{32}", session_id):
+        session_id = uuid.uuid4().hex
+    max_age = CHAT_RETENTION_DAYS * 24 * 60 * 60
+    # Only the generated hex id goes into the script
+    st.html(
+        f"<script>document.cookie = '{CHAT_SESSION_COOKIE}={session_id}; path=/; max-age={max_age}; SameSite=Strict';</script>",
+        unsafe_allow_javascript=True,
+    )
+    return session_id
+
+# Delete chat histories not visited for CHAT_RETENTION_DAYS (runs at most once a day per process)
+@st.cache_resource(ttl=24 * 60 * 60)
+def prune_chat_history():
+    if not os.path.isdir(CHAT_HISTORY_DIR):
+        return
+    cutoff = time.time() - CHAT_RETENTION_DAYS * 24 * 60 * 60
+    for name in os.listdir(CHAT_HISTORY_DIR):
+        path = os.path.join(CHAT_HISTORY_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError as e:
+            print(f"Failed to prune {path}: {e}")
+
+def chat_history_path(chat):
+    return os.path.join(CHAT_HISTORY_DIR, f"{st.session_state.chat_session_id}_{chat}.jsonl")
+
+# Load a chat's stored history after the greeting message.
+# The greeting is never stored, the file is only created with the first real message.
+def load_chat_history(chat, greeting):
+    messages = [{"role": "assistant", "content": greeting}]
+    path = chat_history_path(chat)
+    if os.path.exists(path):
+        # Mark the history as visited, it expires on the same basis as the session cookie
+        os.utime(path)
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                # A crash mid-append can leave a truncated last line, skip it instead of failing the page
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"Skipping malformed line {line_number} in {path}")
+    return messages
+
+# Append a message to the session list and to the chat's JSONL file
+def append_chat_message(chat, message):
+    st.session_state[chat].append(message)
+    os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
+    with open(chat_history_path(chat), "a", encoding="utf-8") as f:
+        f.write(json.dumps(message) + "\n")
+
+# Most recent messages of a chat, with a button to page in older turns
+def visible_chat_messages(chat):
+    messages = st.session_state[chat]
+    pages_key = f"{chat}_pages"
+    pages = st.session_state.setdefault(pages_key, 1)
+    start = max(len(messages) - pages * CHAT_PAGE_SIZE, 0)
+    if start > 0 and st.button(f"Show older messages ({start} more)", key=f"{chat}_older"):
+        st.session_state[pages_key] += 1
+        start = max(start - CHAT_PAGE_SIZE, 0)
+    return messages[start:]
+
+# Bounded tail of a chat to send to OpenAI, leaving out failed turns
+def chat_context_messages(chat):
+    messages = [msg for msg in st.session_state[chat] if not msg.get("error")]
+    return [{"role": msg["role"], "content": msg["content"]} for msg in messages[-CHAT_CONTEXT_MESSAGES:]]
+
+prune_chat_history()
+
+if "chat_session_id" not in st.session_state:
+    st.session_state.chat_session_id = get_chat_session_id()
+
 # Chatbot 2.0 Section with Enhanced Styling and Animations
 st.markdown('<div class="main-header">🤖 Chatbot 2.0 - Fine-Tuned on Report Data</div>', unsafe_allow_html=True)
 st.markdown("📋 This chatbot uses OpenAI and the **consolidated report** data to answer your queries.")
@@ -577,9 +954,9 @@ st.markdown("""
 
 # Initialize session state for Chatbot 2.0 messages
 if "messages_2" not in st.session_state:
-    st.session_state["messages_2"] = [
-        {"role": "assistant", "content": "I am here to answer questions based on your consolidated report. How can I help you?"}
-    ]
+    st.session_state["messages_2"] = load_chat_history(
+        "messages_2", "I am here to answer questions based on your consolidated report. How can I help you?"
+    )
 
 # Chatbot 2.0 input box
 chat_input_2 = st.chat_input("Ask a question about the consolidated report...")
@@ -638,28 +1015,27 @@ st.markdown('</div>', unsafe_allow_html=True)
 
 # Process Chatbot 2.0 input
 if chat_input_2:
-    st.session_state["messages_2"].append({"role": "user", "content": chat_input_2})
-
-    # Specify the path to your Excel file
-    df, sha = fetch_excel_from_github()
+    append_chat_message("messages_2", {"role": "user", "content": chat_input_2})
 
-    # Prepare report data as context
-    report_context = format_report_for_context(df)
+    # Prepare the shared report data as context
+    report_context = format_report_for_context(report_frame)
 
     # Generate a response using OpenAI
     with st.spinner("Generating response..."):
         bot_reply_2 = generate_openai_response(chat_input_2, report_context)
 
-    st.session_state["messages_2"].append({"role": "assistant", "content": bot_reply_2})
+    append_chat_message("messages_2", {"role": "assistant", "content": bot_reply_2})
 
 # Display Chatbot 2.0 conversation with new styling
-for msg in st.session_state["messages_2"]:
+for msg in visible_chat_messages("messages_2"):
+    # Escape the message text before placing it in the hand-built HTML
+    content = html.escape(msg["content"]).replace("\n", "<br>")
     if msg["role"] == "user":
         st.markdown(
             f"""
             <div class="user-message">
                 <div class="chat-avatar user-avatar"></div>
-                <div class="chat-bubble">{msg["content"]}</div>
+                <div class="chat-bubble">{content}</div>
             </div>
             """, unsafe_allow_html=True
         )
@@ -668,7 +1044,7 @@ for msg in st.session_state["messages_2"]:
             f"""
             <div class="assistant-message">
                 <div class="chat-avatar assistant-avatar"></div>
-                <div class="chat-bubble">{msg["content"]}</div>
+                <div class="chat-bubble">{content}</div>
             </div>
             """, unsafe_allow_html=True
         )
@@ -712,28 +1088,29 @@ user_input = st.chat_input("Ask a question or select a prompt...")
 
 # Initialize session state for chat history
 if "messages" not in st.session_state:
-    st.session_state["messages"] = [{"role": "assistant", "content": "How can I assist you today?"}]
+    st.session_state["messages"] = load_chat_history("messages", "How can I assist you today?")
 
 # Append user input or prompt to chat history
 if prompt or user_input:
     user_message = prompt if prompt else user_input
-    st.session_state["messages"].append({"role": "user", "content": user_message})
+    append_chat_message("messages", {"role": "user", "content": user_message})
 
-    # Query OpenAI API with the current messages
+    # Query OpenAI API with the most recent messages
     with st.spinner("Generating response..."):
         try:
             response = openai.ChatCompletion.create(
                 model="gpt-3.5-turbo",
-                messages=st.session_state["messages"]
+                messages=chat_context_messages("messages")
             )
             bot_reply = response.choices[0]["message"]["content"]
-            st.session_state["messages"].append({"role": "assistant", "content": bot_reply})
+            append_chat_message("messages", {"role": "assistant", "content": bot_reply})
         except Exception as e:
             bot_reply = f"Error retrieving response: {e}"
-            st.session_state["messages"].append({"role": "assistant", "content": bot_reply})
+            # Shown in the history, but never sent back to the model
+            append_chat_message("messages", {"role": "assistant", "content": bot_reply, "error": True})
 
 # Display chat history sequentially
-for msg in st.session_state["messages"]:
+for msg in visible_chat_messages("messages"):
     if msg["role"] == "user":
         st.chat_message("user").write(msg["content"])
     elif msg["role"] == "assistant":